@@ -0,0 +1,238 @@
+"""
+端到端吞吐量测试: 并发运行整条节点链, 统计 p50 / p99 延迟和每秒处理的图片数。
+
+默认在本进程内启动 stub_servers.py 中的替身服务, 也可以用 --image-url / --order-url / --hf-endpoint
+指向已经运行的服务。节点依赖 ComfyUI 的 folder_paths, 需要在 ComfyUI 的 Python 环境中运行,
+--comfyui-root 默认为本插件所在 custom_nodes 目录的上一级。
+
+用法:
+    python load_test.py --chain imagebb --concurrency 8 --runs 200 --images-per-run 4 --latency-ms 50 --error-rate 0.01
+    python load_test.py --chain hf-push --concurrency 4 --runs 50
+
+节点链:
+    imagebb      PushToImageBB -> UpdateOrder
+    hf-push      PushToHFDataset
+    hf-shards    UploadAllOutputsToHFDataset (webdataset 分片)
+    hf-download  DownloadFromHFDataset (每次运行使用新的下载目录)
+    full         PushToImageBB -> UpdateOrder, 同时 PushToHFDataset
+"""
+import argparse
+import importlib.util
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+FAILURE_PREFIXES = ("Upload failed", "Download failed", "No files", "Outputs folder does not exist")
+
+
+def load_nodes(comfyui_root):
+    """以包的方式导入本插件, 返回 NODE_CLASS_MAPPINGS。"""
+    if comfyui_root not in sys.path:
+        sys.path.insert(0, comfyui_root)
+    name = os.path.basename(PACKAGE_DIR).replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PACKAGE_DIR, "__init__.py"),
+                                                  submodule_search_locations=[PACKAGE_DIR])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module.NODE_CLASS_MAPPINGS
+
+
+def make_images(folder, count, size):
+    from PIL import Image
+    os.makedirs(folder, exist_ok=True)
+    filepaths = []
+    for index in range(count):
+        file_path = os.path.join(folder, f"LoadTest_{index:05d}_.png")
+        Image.frombytes("RGB", (size, size), os.urandom(size * size * 3)).save(file_path)
+        filepaths.append(file_path)
+    return filepaths
+
+
+def check(result):
+    if isinstance(result, str) and result.startswith(FAILURE_PREFIXES):
+        raise RuntimeError(result)
+    return result
+
+
+class Chains:
+    """每个方法运行一次节点链, 返回成功处理的图片数, 失败时抛出异常。"""
+
+    def __init__(self, nodes, args, work_dir, source_files, order_records=None):
+        self.nodes = nodes
+        # 替身订单服务记录的更新, 用来确认 UpdateOrder 真的成功了 (节点本身在请求失败时也会原样返回 outputs)
+        self.order_records = order_records
+        self.args = args
+        self.work_dir = work_dir
+        self.source_files = source_files
+        self.dataset = args.dataset
+
+    def imagebb(self, run_id):
+        outputs, = self.nodes["PushToImageBB"]().upload("", self.source_files, [0.0] * len(self.source_files),
+                                                         upload_url=self.args.image_url)
+        check(outputs)
+        uploaded = len(outputs.split(",")) if outputs else 0
+        if uploaded != len(self.source_files):
+            raise RuntimeError(f"only {uploaded} of {len(self.source_files)} images uploaded")
+        self.nodes["UpdateOrder"]().updateorder(outputs, self.args.order_url, False, run_id)
+        if self.order_records is not None:
+            record = self.order_records.get(run_id)
+            expected = ",".join(item.split("|||")[0] for item in outputs.split(","))
+            if record is None or record.get("output_paths") != expected:
+                raise RuntimeError(f"order {run_id} was not updated")
+        return uploaded
+
+    def hf_push(self, run_id):
+        result, = self.nodes["PushToHFDataset"]().push(self.args.hf_token, self.dataset, f"runs/{run_id}", self.source_files)
+        check(result)
+        return len(self.source_files)
+
+    def hf_shards(self, run_id):
+        result, = self.nodes["UploadAllOutputsToHFDataset"]().upload(
+            self.args.hf_token, self.dataset, f"shards/{run_id}", os.path.dirname(self.source_files[0]),
+            output_mode="webdataset", order_id=run_id,
+        )
+        check(result)
+        return len(self.source_files)
+
+    def hf_download(self, run_id):
+        download_folder = os.path.join(self.work_dir, "downloads", str(run_id))
+        try:
+            result, = self.nodes["DownloadFromHFDataset"]().download(self.args.hf_token, self.dataset, download_folder)
+            check(result)
+            # 文件按仓库路径保存在子目录中 (seed/...), 跳过 .cache 和列表缓存这类隐藏文件
+            downloaded = 0
+            for root, dirs, files in os.walk(download_folder):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                downloaded += len([f for f in files if not f.startswith(".")])
+            return downloaded
+        finally:
+            shutil.rmtree(download_folder, ignore_errors=True)
+
+    def full(self, run_id):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            hf = pool.submit(self.hf_push, run_id)
+            uploaded = self.imagebb(run_id)
+            hf.result()
+        return uploaded
+
+    def seed(self):
+        # hf-download 需要仓库里先有数据
+        check(self.nodes["PushToHFDataset"]().push(self.args.hf_token, self.dataset, "seed", self.source_files)[0])
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_load(chain, runs, concurrency):
+    latencies = []
+    errors = []
+    images = [0]
+    lock = threading.Lock()
+
+    def run_once(run_id):
+        start = time.perf_counter()
+        try:
+            count = chain(run_id)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            images[0] += count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_once, range(runs)))
+    wall = time.perf_counter() - started
+    return latencies, errors, images[0], wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive node chains concurrently against local stand-in servers.")
+    parser.add_argument("--chain", choices=["imagebb", "hf-push", "hf-shards", "hf-download", "full"], default="imagebb")
+    parser.add_argument("--runs", type=int, default=50, help="Total number of chain runs.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of chains running at the same time.")
+    parser.add_argument("--images-per-run", type=int, default=4)
+    parser.add_argument("--image-size", type=int, default=512, help="Width and height of the generated PNGs.")
+    parser.add_argument("--comfyui-root", default=os.environ.get("COMFYUI_ROOT", os.path.dirname(os.path.dirname(PACKAGE_DIR))))
+    parser.add_argument("--hf-token", default="hf_load_test")
+    parser.add_argument("--dataset", default="load-test/outputs")
+    parser.add_argument("--image-url", default=None, help="Use an existing image upload endpoint instead of the stub.")
+    parser.add_argument("--order-url", default=None, help="Use an existing order update endpoint instead of the stub.")
+    parser.add_argument("--hf-endpoint", default=None, help="Use an existing Hub endpoint instead of the stub.")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Stub latency per request.")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Stub random extra latency per request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Stub fraction of failed requests.")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0, help="Stub per-connection bandwidth limit in KiB/s.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    servers = {}
+    try:
+        stub_services = {}
+        if args.image_url is None:
+            stub_services["image"] = 0
+        if args.order_url is None:
+            stub_services["order"] = 0
+        if args.hf_endpoint is None:
+            stub_services["hub"] = 0
+        if stub_services:
+            from stub_servers import start_servers
+            servers = start_servers(stub_services, storage_dir=os.path.join(work_dir, "stub"),
+                                    latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                    error_rate=args.error_rate, bandwidth_kbps=args.bandwidth_kbps)
+
+        def stub_url(name, path=""):
+            return f"http://127.0.0.1:{servers[name].server_address[1]}{path}"
+
+        args.image_url = args.image_url or stub_url("image", "/upload-image-binary")
+        args.order_url = args.order_url or stub_url("order", "/update-submission-urls")
+        # HF_ENDPOINT 必须在导入 huggingface_hub 之前设置
+        os.environ["HF_ENDPOINT"] = args.hf_endpoint or stub_url("hub")
+
+        nodes = load_nodes(args.comfyui_root)
+        source_files = make_images(os.path.join(work_dir, "outputs"), args.images_per_run, args.image_size)
+        order_records = None
+        if "order" in servers:
+            from stub_servers import OrderHandler
+            order_records = OrderHandler.orders
+        elif args.chain in ("imagebb", "full"):
+            print("Note: --order-url points to an external service, failed order updates are not detected.")
+        chains = Chains(nodes, args, work_dir, source_files, order_records)
+        if args.chain == "hf-download":
+            chains.seed()
+
+        print(f"Running chain '{args.chain}': {args.runs} runs, concurrency {args.concurrency}, "
+              f"{args.images_per_run} images of {args.image_size}x{args.image_size} per run")
+        latencies, errors, images, wall = run_load(getattr(chains, args.chain.replace("-", "_")), args.runs, args.concurrency)
+
+        print(f"ok: {len(latencies)}  failed: {len(errors)}  wall time: {wall:.2f}s")
+        print(f"latency p50: {percentile(latencies, 50) * 1000:.1f}ms  p90: {percentile(latencies, 90) * 1000:.1f}ms  "
+              f"p99: {percentile(latencies, 99) * 1000:.1f}ms  max: {max(latencies, default=0) * 1000:.1f}ms")
+        print(f"throughput: {len(latencies) / wall:.2f} runs/s  {images / wall:.2f} images/s")
+        for error in sorted(set(errors))[:10]:
+            print(f"error: {error}")
+        for name, server in servers.items():
+            print(f"stub {name}: {server.stats}")
+    finally:
+        for server in servers.values():
+            server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""
+本地替身服务, 用于在不访问真实服务的情况下对节点做端到端吞吐量测试:
+  - image: 图床二进制上传接口 (PushToImageBB 的 upload_url)
+  - order: 订单更新接口 (UpdateOrder 的 host_update_order)
+  - hub:   最小化的 HuggingFace Hub API (refs / tree / preupload / LFS batch / commit / resolve)
+
+每个服务都支持可配置的延迟、错误率和带宽限制。
+
+用法:
+    python stub_servers.py --latency-ms 50 --jitter-ms 20 --error-rate 0.01 --bandwidth-kbps 20000
+
+然后把节点指向本地服务:
+    PushToImageBB.upload_url      = http://127.0.0.1:8701/upload-image-binary
+    UpdateOrder.host_update_order = http://127.0.0.1:8702/update-submission-urls
+    HF_ENDPOINT=http://127.0.0.1:8703  (必须在导入 huggingface_hub 之前设置)
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+CHUNK_SIZE = 64 * 1024
+# 超过这个大小的文件在 preupload 时返回 lfs, 走 LFS batch + PUT 上传
+LFS_THRESHOLD = 10 * 1024 * 1024
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, latency_ms=0, jitter_ms=0, error_rate=0.0,
+                 error_statuses=(429, 503), bandwidth_kbps=0, storage_dir=None):
+        super().__init__(address, handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.bandwidth = bandwidth_kbps * 1024
+        self.storage_dir = storage_dir
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def handle_error(self, request, client_address):
+        # 客户端在负载测试中途断开连接是正常情况, 不打印堆栈
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def throttle(self, size):
+        if self.server.bandwidth > 0:
+            time.sleep(size / self.server.bandwidth)
+
+    def read_body(self):
+        chunks = []
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                self.throttle(size)
+        else:
+            remaining = int(self.headers.get("Content-Length") or 0)
+            while remaining > 0:
+                chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                remaining -= len(chunk)
+                self.throttle(len(chunk))
+        body = b"".join(chunks)
+        self.server.count("bytes_in", len(body))
+        return body
+
+    def send_body(self, status, body=b"", content_type="application/json", headers=None, head_only=False):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if head_only:
+            return
+        for start in range(0, len(body), CHUNK_SIZE):
+            chunk = body[start:start + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            self.throttle(len(chunk))
+        self.server.count("bytes_out", len(body))
+
+    def send_json(self, status, data, headers=None, head_only=False):
+        self.send_body(status, json.dumps(data).encode("utf-8"), headers=headers, head_only=head_only)
+
+    def simulate(self):
+        """模拟延迟和随机错误, 返回 True 表示已经发送了错误响应。"""
+        self.server.count("requests")
+        delay = self.server.latency_ms + random.uniform(0, self.server.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if random.random() < self.server.error_rate:
+            self.server.count("errors")
+            # 先把请求体读完, 避免客户端写入时连接被重置
+            self.read_body()
+            status = random.choice(self.server.error_statuses)
+            # HEAD 响应不能带 body, 否则 keep-alive 连接上的下一个响应会错位
+            self.send_json(status, {"error": "simulated failure"}, headers={"Retry-After": "1"} if status == 429 else None,
+                           head_only=self.command == "HEAD")
+            return True
+        return False
+
+    def base_url(self):
+        return f"http://{self.headers.get('Host') or '%s:%d' % self.server.server_address}"
+
+    def do_GET(self):
+        if not self.simulate():
+            self.handle_get()
+
+    def do_HEAD(self):
+        if not self.simulate():
+            self.handle_get(head_only=True)
+
+    def do_POST(self):
+        if not self.simulate():
+            self.handle_post()
+
+    def do_PUT(self):
+        if not self.simulate():
+            self.handle_put()
+
+    def handle_get(self, head_only=False):
+        self.send_json(404, {"error": "not found"}, head_only=head_only)
+
+    def handle_post(self):
+        self.send_json(404, {"error": "not found"})
+
+    def handle_put(self):
+        self.send_json(404, {"error": "not found"})
+
+
+class ImageHostHandler(StubHandler):
+    """替身图床: POST /upload-image-binary, 返回与 all4bridge 相同格式的 url / thumb / size。"""
+
+    def handle_post(self):
+        if urlsplit(self.path).path != "/upload-image-binary":
+            return super().handle_post()
+        body = self.read_body()
+        name = hashlib.sha256(body).hexdigest()[:16]
+        with open(os.path.join(self.server.storage_dir, f"{name}.png"), "wb") as f:
+            f.write(body)
+        self.send_json(200, {
+            "url": f"{self.base_url()}/images/{name}.png",
+            "thumb": f"{self.base_url()}/images/{name}.png?thumb=1",
+            "size": len(body),
+        })
+
+    def handle_get(self, head_only=False):
+        match = re.match(r"^/images/([0-9a-f]+\.png)$", urlsplit(self.path).path)
+        file_path = match and os.path.join(self.server.storage_dir, match.group(1))
+        if not file_path or not os.path.exists(file_path):
+            return super().handle_get(head_only)
+        with open(file_path, "rb") as f:
+            self.send_body(200, f.read(), content_type="image/png", head_only=head_only)
+
+
+class OrderHandler(StubHandler):
+    """替身订单服务: POST /update-submission-urls, 记录最近的更新并原样返回。"""
+
+    orders = {}
+
+    def handle_post(self):
+        if urlsplit(self.path).path != "/update-submission-urls":
+            return super().handle_post()
+        try:
+            data = json.loads(self.read_body() or b"{}")
+        except ValueError:
+            return self.send_json(400, {"error": "invalid json"})
+        with self.server.lock:
+            self.orders[data.get("id")] = data
+        self.send_json(200, {"success": True, "data": data})
+
+
+class HubRepo:
+    def __init__(self):
+        self.head = hashlib.sha1(os.urandom(16)).hexdigest()
+        # path -> {"oid": blob id, "size": int, "sha256": str, "lfs": bool}
+        self.files = {}
+
+
+class HubHandler(StubHandler):
+    """
+    最小化的 Hub API, 覆盖本项目节点用到的接口:
+      GET  /api/{type}s/{repo}/refs
+      GET  /api/{type}s/{repo}/tree/{rev}[/{path}]
+      POST /api/{type}s/{repo}/preupload/{rev}
+      POST /api/{type}s/{repo}/commit/{rev}
+      POST /{prefix}{repo}.git/info/lfs/objects/batch
+      PUT  /lfs/{sha256}
+      GET  /{prefix}{repo}/resolve/{rev}/{path}
+    仓库在第一次提交时自动创建, 文件内容按 sha256 存放在 storage_dir 中。
+    """
+
+    repos = {}
+    API_RE = re.compile(r"^/api/(models|datasets|spaces)/([^/]+/[^/]+)/(refs|tree|preupload|commit)(?:/([^/]+))?(?:/(.*))?$")
+    LFS_BATCH_RE = re.compile(r"^/(?:(datasets|spaces)/)?([^/]+/[^/]+)\.git/info/lfs/objects/batch$")
+    RESOLVE_RE = re.compile(r"^/(?:(datasets|spaces)/)?([^/]+/[^/]+)/resolve/([^/]+)/(.+)$")
+
+    def repo(self, repo_type, repo_id, create=False):
+        key = f"{repo_type}/{repo_id}"
+        with self.server.lock:
+            if key not in self.repos and create:
+                self.repos[key] = HubRepo()
+            return self.repos.get(key)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.server.storage_dir, sha256)
+
+    def store_blob(self, data):
+        sha256 = hashlib.sha256(data).hexdigest()
+        with open(self.blob_path(sha256), "wb") as f:
+            f.write(data)
+        return sha256
+
+    def handle_get(self, head_only=False):
+        path = unquote(urlsplit(self.path).path)
+        match = self.API_RE.match(path)
+        if match:
+            repo_type, repo_id, action, revision, subpath = match.groups()
+            repo = self.repo(repo_type, repo_id)
+            if repo is None:
+                return self.send_json(404, {"error": "Repository not found"}, headers={"X-Error-Code": "RepoNotFound"}, head_only=head_only)
+            if action == "refs":
+                return self.send_json(200, {
+                    "branches": [{"name": "main", "ref": "refs/heads/main", "targetCommit": repo.head}],
+                    "tags": [],
+                    "converts": [],
+                    "pullRequests": [],
+                }, head_only=head_only)
+            if action == "tree":
+                return self.send_json(200, self.tree_entries(repo, subpath or ""), head_only=head_only)
+
+        match = self.RESOLVE_RE.match(path)
+        if match:
+            prefix, repo_id, revision, file_path = match.groups()
+            repo = self.repo(prefix or "models", repo_id)
+            entry = repo and repo.files.get(file_path)
+            if entry is None:
+                return self.send_json(404, {"error": "Entry not found"}, headers={"X-Error-Code": "EntryNotFound"}, head_only=head_only)
+            with open(self.blob_path(entry["sha256"]), "rb") as f:
+                data = f.read()
+            etag = entry["sha256"] if entry["lfs"] else entry["oid"]
+            headers = {"X-Repo-Commit": repo.head, "ETag": f'"{etag}"'}
+            if entry["lfs"]:
+                headers.update({"X-Linked-Etag": f'"{etag}"', "X-Linked-Size": str(entry["size"])})
+            return self.send_body(200, data, content_type="application/octet-stream", headers=headers, head_only=head_only)
+
+        super().handle_get(head_only)
+
+    def tree_entries(self, repo, subpath):
+        entries = []
+        folders = set()
+        for file_path, entry in sorted(repo.files.items()):
+            if subpath and not file_path.startswith(subpath.rstrip("/") + "/"):
+                continue
+            parts = file_path.split("/")
+            for depth in range(1, len(parts)):
+                folders.add("/".join(parts[:depth]))
+            item = {"type": "file", "oid": entry["oid"], "size": entry["size"], "path": file_path}
+            if entry["lfs"]:
+                item["lfs"] = {"oid": entry["sha256"], "size": entry["size"], "pointerSize": 134}
+            entries.append(item)
+        for folder in sorted(folders):
+            if not subpath or folder.startswith(subpath.rstrip("/") + "/"):
+                entries.append({"type": "directory", "oid": hashlib.sha1(folder.encode("utf-8")).hexdigest(), "size": 0, "path": folder})
+        return entries
+
+    def handle_post(self):
+        path = unquote(urlsplit(self.path).path)
+        match = self.API_RE.match(path)
+        if match and match.group(3) == "preupload":
+            payload = json.loads(self.read_body() or b"{}")
+            return self.send_json(200, {"files": [
+                {"path": f["path"], "uploadMode": "lfs" if f.get("size", 0) >= LFS_THRESHOLD else "regular", "shouldIgnore": False}
+                for f in payload.get("files", [])
+            ]})
+        if match and match.group(3) == "commit":
+            return self.handle_commit(match.group(1), match.group(2))
+
+        match = self.LFS_BATCH_RE.match(path)
+        if match:
+            payload = json.loads(self.read_body() or b"{}")
+            objects = []
+            for obj in payload.get("objects", []):
+                item = {"oid": obj["oid"], "size": obj["size"]}
+                if not os.path.exists(self.blob_path(obj["oid"])):
+                    item["actions"] = {"upload": {"href": f"{self.base_url()}/lfs/{obj['oid']}", "header": {}}}
+                objects.append(item)
+            return self.send_json(200, {"transfer": "basic", "objects": objects})
+
+        super().handle_post()
+
+    def handle_commit(self, repo_type, repo_id):
+        lines = [json.loads(line) for line in self.read_body().splitlines() if line.strip()]
+        repo = self.repo(repo_type, repo_id, create=True)
+        changes = {}
+        deleted = []
+        for line in lines:
+            key, value = line.get("key"), line.get("value", {})
+            if key == "file":
+                data = base64.b64decode(value["content"]) if value.get("encoding") == "base64" else value["content"].encode("utf-8")
+                sha256 = self.store_blob(data)
+                oid = hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+                changes[value["path"]] = {"oid": oid, "size": len(data), "sha256": sha256, "lfs": False}
+            elif key == "lfsFile":
+                if not os.path.exists(self.blob_path(value["oid"])):
+                    return self.send_json(400, {"error": f"LFS object {value['oid']} was not uploaded"})
+                oid = hashlib.sha1(f"lfs {value['oid']}".encode("utf-8")).hexdigest()
+                changes[value["path"]] = {"oid": oid, "size": value["size"], "sha256": value["oid"], "lfs": True}
+            elif key in ("deletedFile", "deletedFolder"):
+                deleted.append(value["path"])
+
+        with self.server.lock:
+            for deleted_path in deleted:
+                for file_path in list(repo.files):
+                    if file_path == deleted_path or file_path.startswith(deleted_path.rstrip("/") + "/"):
+                        del repo.files[file_path]
+            repo.files.update(changes)
+            repo.head = hashlib.sha1(f"{repo.head}{time.time()}{sorted(changes)}".encode("utf-8")).hexdigest()
+            head = repo.head
+
+        prefix = "" if repo_type == "models" else f"{repo_type}/"
+        self.send_json(200, {"commitUrl": f"{self.base_url()}/{prefix}{repo_id}/commit/{head}", "commitOid": head, "success": True})
+
+    def handle_put(self):
+        match = re.match(r"^/lfs/([0-9a-f]{64})$", urlsplit(self.path).path)
+        if not match:
+            return super().handle_put()
+        data = self.read_body()
+        if hashlib.sha256(data).hexdigest() != match.group(1):
+            return self.send_json(400, {"error": "sha256 mismatch"})
+        self.store_blob(data)
+        self.send_body(200, b"")
+
+
+SERVICES = {
+    "image": (ImageHostHandler, 8701),
+    "order": (OrderHandler, 8702),
+    "hub": (HubHandler, 8703),
+}
+
+
+def start_servers(services, host="127.0.0.1", storage_dir=None, **options):
+    """在后台线程中启动替身服务, 返回 {服务名: server}。端口为 0 时自动分配。"""
+    storage_dir = storage_dir or tempfile.mkdtemp(prefix="stub_servers_")
+    servers = {}
+    for name, port in services.items():
+        handler, _ = SERVICES[name]
+        service_dir = os.path.join(storage_dir, name)
+        os.makedirs(service_dir, exist_ok=True)
+        server = StubServer((host, port), handler, storage_dir=service_dir, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[name] = server
+    return servers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-ins for the image host, order service and HuggingFace Hub.")
+    parser.add_argument("--services", default="image,order,hub", help="Comma separated list of services to start.")
+    parser.add_argument("--host", default="127.0.0.1")
+    for name, (_, port) in SERVICES.items():
+        parser.add_argument(f"--{name}-port", type=int, default=port)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Fixed latency added to every request.")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra latency, uniform in [0, jitter].")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error status.")
+    parser.add_argument("--error-statuses", default="429,503", help="Comma separated statuses used for simulated errors.")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0, help="Per-connection bandwidth limit in KiB/s, 0 for unlimited.")
+    parser.add_argument("--storage-dir", default=None, help="Where uploaded data is kept. Defaults to a temporary directory.")
+    args = parser.parse_args()
+
+    services = {name: getattr(args, f"{name}_port") for name in args.services.split(",") if name}
+    servers = start_servers(
+        services,
+        host=args.host,
+        storage_dir=args.storage_dir,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_statuses=tuple(int(s) for s in args.error_statuses.split(",")),
+        bandwidth_kbps=args.bandwidth_kbps,
+    )
+    for name, server in servers.items():
+        print(f"{name}: http://{args.host}:{server.server_address[1]}")
+
+    try:
+        while True:
+            time.sleep(10)
+            print(" | ".join(f"{name}: {json.dumps(server.stats)}" for name, server in servers.items()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers.values():
+            server.shutdown()
+        if args.storage_dir is None:
+            shutil.rmtree(os.path.dirname(next(iter(servers.values())).storage_dir), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()